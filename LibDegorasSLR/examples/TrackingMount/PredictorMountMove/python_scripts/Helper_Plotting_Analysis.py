@@ -2,43 +2,54 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import math
+import functools
 import os
 from matplotlib.animation import FuncAnimation
+from matplotlib.collections import LineCollection
 from matplotlib.patches import Circle, Wedge
 
 
-def plot_ascending_descending_segments(ax, track_azimuths, track_elevations):
+def find_ascending_descending_segments(track_elevations):
     """
-    Plot ascending and descending segments of the track based on elevation changes.
+    Find the ascending and descending segments of the track based on elevation changes.
+    Returns two (N, 2) arrays with the [start, end) point indexes of each segment.
     """
-    elevation_diff = [track_elevations[i] - track_elevations[i-1] for i in range(1, len(track_elevations))]
+    track_elevations = np.asarray(track_elevations)
 
-    ascending_segments = []
-    descending_segments = []
+    # Sign of the elevation change between consecutive points.
+    elevation_sign = np.sign(np.diff(track_elevations))
 
-    segment_start = 0
-    for i, diff in enumerate(elevation_diff):
-        if diff > 0:
-            if i == 0 or elevation_diff[i-1] <= 0:
-                segment_start = i
-        elif diff < 0:
-            if i == 0 or elevation_diff[i-1] >= 0:
-                if i - segment_start > 1:  # To avoid single point segments
-                    ascending_segments.append((segment_start, i))
-                segment_start = i
+    # Split the track into runs with the same sign of elevation change.
+    boundaries = np.flatnonzero(np.diff(elevation_sign)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(elevation_sign)]))
 
-    if elevation_diff[-1] > 0:
-        if len(elevation_diff) - segment_start > 1:  # To avoid single point segments
-            ascending_segments.append((segment_start, len(elevation_diff)))
-    elif elevation_diff[-1] < 0:
-        if len(elevation_diff) - segment_start > 1:  # To avoid single point segments
-            descending_segments.append((segment_start, len(elevation_diff)))
+    # Avoid single point segments. Each run of differences [start, end) covers the points [start, end].
+    valid = (ends - starts) > 1
+    run_sign = elevation_sign[starts]
+    segments = np.column_stack((starts, ends + 1))
+    ascending_segments = segments[valid & (run_sign > 0)]
+    descending_segments = segments[valid & (run_sign < 0)]
 
-    for start, end in ascending_segments:
-        ax.plot(track_azimuths[start:end], track_elevations[start:end], color='green', linewidth=2, label='Track ascending')
+    return ascending_segments, descending_segments
 
-    for start, end in descending_segments:
-        ax.plot(track_azimuths[start:end], track_elevations[start:end], color='red', linewidth=2, label='Track descending')
+
+def plot_ascending_descending_segments(ax, track_azimuths, track_elevations):
+    """
+    Plot ascending and descending segments of the track based on elevation changes.
+    """
+    ascending_segments, descending_segments = find_ascending_descending_segments(track_elevations)
+
+    track_points = np.column_stack((track_azimuths, track_elevations))
+
+    # Draw all the segments of each kind as a single artist.
+    if len(ascending_segments):
+        ascending_lines = [track_points[start:end] for start, end in ascending_segments]
+        ax.add_collection(LineCollection(ascending_lines, colors='green', linewidths=2, label='Track ascending'))
+
+    if len(descending_segments):
+        descending_lines = [track_points[start:end] for start, end in descending_segments]
+        ax.add_collection(LineCollection(descending_lines, colors='red', linewidths=2, label='Track descending'))
 
 
 def plot_full_coverage_circle(ax, radius_deg, points, color):
@@ -48,28 +59,39 @@ def plot_full_coverage_circle(ax, radius_deg, points, color):
     ax.plot(edge_angle, edge_radius, color, linestyle='--')
 
 
+@functools.lru_cache(maxsize=8)
+def unit_circle(points):
+    """
+    Cosine and sine of the angles of a unit circle sampled at the given number of points.
+    The arrays are cached, so they are returned as read-only.
+    """
+    angle = np.linspace(0, 2*np.pi, points)
+    cos_angle = np.cos(angle)
+    sin_angle = np.sin(angle)
+    cos_angle.setflags(write=False)
+    sin_angle.setflags(write=False)
+    return cos_angle, sin_angle
+
+
 def gen_projected_circle(ax, x_deg, y_deg, r_deg, plot_circle = True, \
                          points = 1000, color='yellow', zorder = 2, alph = 0.5) :
 
-    print(y_deg)
-
     # Check if the security sector exceeds the zenith
     if math.ceil(y_deg) + r_deg >= 90:
         plot_full_coverage_circle(ax, r_deg, points, color)
         return
 
     # Project the Sun avoid zone.
-    angle = np.linspace(0, 2*np.pi, points)
-    xvec = np.cos(angle) * r_deg + x_deg
-    yvec = np.sin(angle) * r_deg + y_deg
+    cos_angle, sin_angle = unit_circle(points)
+    xvec = cos_angle * r_deg + x_deg
+    yvec = sin_angle * r_deg + y_deg
 
     # Adjust for points beyond the zenith
-    for i in range(len(yvec)):
-        if yvec[i] > 90:
-            # Reflect the elevation
-            yvec[i] = 180 - yvec[i]
-            # Reflect the azimuth, ensuring it remains in the range [0, 360]
-            xvec[i] = (xvec[i] + 180) % 360
+    beyond_zenith = yvec > 90
+    # Reflect the elevation
+    yvec[beyond_zenith] = 180 - yvec[beyond_zenith]
+    # Reflect the azimuth, ensuring it remains in the range [0, 360]
+    xvec[beyond_zenith] = (xvec[beyond_zenith] + 180) % 360
 
     # Plot on the provided axis.
     if(plot_circle):
@@ -80,47 +102,44 @@ def gen_projected_circle(ax, x_deg, y_deg, r_deg, plot_circle = True, \
 
 def plot_track_culmination(ax, azs, els, color='blue', s=40, zorder=4, label='Track Culmination'):
 
-    # Find the maximum value
-    max_el_idx = np.argmax(els)
-    max_el = els[max_el_idx]
-    max_idxs = [index for index, value in enumerate(els) if value == max_el]
+    azs = np.asarray(azs)
+    els = np.asarray(els)
 
-    # Check if the maximum elevation occurs at more than one point
-    if len(max_idxs) > 1:
-        # Plot a line connecting all points with the maximum elevation
-        for idx in max_idxs:
-            # Ensure continuity in the plot by connecting adjacent points
-            if idx < len(azs) - 1 and (idx + 1) in max_idxs:
-                ax.plot(azs[idx:idx+2], els[idx:idx+2], color=color, label=label, zorder=zorder)
-                label = "_"  # Avoid duplicate labels in legend
-    else:
-        # Plot a single point if there's only one maximum
-        ax.scatter(azs[max_idxs[0]], els[max_idxs[0]], color=color, s=s, zorder=zorder, label=label)
+    # Find the runs of consecutive points with the maximum elevation
+    max_mask = (els == els.max()).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], max_mask, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    for start, end in zip(starts, ends):
+        if end - start == 1:
+            # Plot a single point if the maximum is not repeated
+            ax.scatter(azs[start], els[start], color=color, s=s, zorder=zorder, label=label)
+        else:
+            # Plot a line connecting all the adjacent points with the maximum elevation
+            ax.plot(azs[start:end], els[start:end], color=color, label=label, zorder=zorder)
+        label = "_"  # Avoid duplicate labels in legend
+
+
+# Converter for the optional CSV fields, which are empty when there is no data
+def empty_to_nan(field):
+    return float(field) if field else np.nan
 
 
 # Function to read positions from file
 def read_positions(filename):
     header_size = 23
-    pass_positions = []
-    track_positions = []
-    sun_positions = []
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-        for line in lines[header_size:]:
-            data = line.split(';')
-            pass_az = float(data[1])
-            pass_el = float(data[2])
-            pass_positions.append((pass_az, pass_el))
-
-            if(data[3] != '' and data[4] != ''):
-                track_az = float(data[3])
-                track_el = float(data[4])
-                track_positions.append((track_az, track_el))
-
-            sun_az = float(data[5])
-            sun_el = float(data[6])
-            sun_positions.append((sun_az, sun_el))
-                        
+    # Parse all the position columns at once. Empty track fields are read as NaN.
+    # The positions have 4 decimals at most, so single precision is enough.
+    data = np.loadtxt(filename, delimiter=';', skiprows=header_size, usecols=range(1, 7),
+                      converters={3: empty_to_nan, 4: empty_to_nan}, dtype=np.float32, ndmin=2)
+    pass_positions = data[:, 0:2]
+    sun_positions = data[:, 4:6]
+
+    # Keep only the rows with valid track data.
+    track_mask = ~np.isnan(data[:, 2]) & ~np.isnan(data[:, 3])
+    track_positions = data[track_mask, 2:4]
+
     return [pass_positions, track_positions, sun_positions]
     
 
@@ -146,12 +165,12 @@ if __name__ == "__main__":
 
     # Extract data
     # ---------------------------------------------------------
-    pass_azimuths = [np.radians(pos[0]) for pos in pass_positions]
-    pass_elevations = [pos[1] for pos in pass_positions]
-    track_azimuths = [np.radians(pos[0]) for pos in track_positions]
-    track_elevations = [pos[1] for pos in track_positions]
-    sun_azimuths = [np.radians(pos[0]) for pos in sun_positions]
-    sun_elevations = [pos[1] for pos in sun_positions]
+    pass_azimuths = np.radians(pass_positions[:, 0])
+    pass_elevations = pass_positions[:, 1]
+    track_azimuths = np.radians(track_positions[:, 0])
+    track_elevations = track_positions[:, 1]
+    sun_azimuths = np.radians(sun_positions[:, 0])
+    sun_elevations = sun_positions[:, 1]
     max_track_el_idx = np.argmax(track_elevations)
     max_pass_el_idx = np.argmax(pass_elevations)
     # ---------------------------------------------------------
@@ -189,7 +208,7 @@ if __name__ == "__main__":
     #    plot_projected_circle(ax, np.degrees(azimuth), elevation, 15, num_points, 'yellow', 2)
 
     # Todo plot the circle in the colision momment.
-    gen_projected_circle(ax, np.degrees(sun_azimuths[0]), sun_elevations[0], 15, True, num_points,'darkorange', 2)
+    gen_projected_circle(ax, sun_positions[0, 0], sun_elevations[0], 15, True, num_points,'darkorange', 2)
     #gen_projected_circle(ax, np.degrees(sun_azimuths[-1]), sun_elevations[-1], 15, True, num_points,'brown', 2)
 
 
@@ -210,7 +229,7 @@ if __name__ == "__main__":
     plt.legend()
 
     # Save plot with high resolution
-    plt.savefig(output_dir + '/' + plot_file_name + '_plot_polar.png', dpi=500)
+    plt.savefig(output_dir + '/' + plot_file_name + '_plot_polar.png', dpi=500, bbox_inches='tight')
 
     # Show plot
     plt.show()